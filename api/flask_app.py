@@ -8,41 +8,308 @@ from __future__ import annotations
 import logging
 import os
 import time
+from typing import TYPE_CHECKING, Any
 
 import flask
-from prometheus_client import Counter, Gauge, generate_latest
+from prometheus_client import Counter, Gauge
 
-from api.model_serving_api import API
+from api.language_routing import LanguageRouter
+from api.metrics import (
+    DEFAULT_METRICS_CACHE_SECONDS,
+    MetricsExporter,
+    create_metrics_registry,
+)
+from api.model_serving_api import API, ERRORS_KEY
+from api.startup import StartupProfiler
+from api.tracing import (
+    DEFAULT_OTLP_ENDPOINT,
+    TRACE_ID_HEADER,
+    FileSpanSink,
+    OTLPHTTPSpanSink,
+    Tracer,
+    trace_span,
+)
 from common.constants import APPLICATION_NAME
 from common.daos.file_based_dao import FileBasedDAO
+from common.exceptions import InferenceUnavailableException
 from common.log import setup_logging
 
+if TYPE_CHECKING:
+    # inference pool modules are imported only when the pool is configured
+    from api.inference_server import InferenceClient, InferencePool
+
 APPLICATION_VERSION = "1.0"
 
+DEFAULT_MAX_REQUEST_BYTES = 1024 * 1024
+DEFAULT_MAX_TEXT_LENGTH = 100_000
+DEFAULT_LANGUAGE_MODEL_WORKERS = 1
+DEFAULT_LANGUAGE_MODEL_QUEUE_SIZE = 32
+DEFAULT_INFERENCE_PROCESSES = 1
+DEFAULT_WARM_UP_LANGUAGES = "en"
+WARM_UP_ATTEMPTS = 8
+WARM_UP_RETRY_DELAY_SECONDS = 1.0
+WARM_UP_MAX_RETRY_DELAY_SECONDS = 30.0
+# below gunicorn worker timeout, which also applies to loading the app
+DEFAULT_WARM_UP_TIMEOUT_SECONDS = 90.0
+
 
-def create_app(config_dictionary: dict[str, str] | None = None) -> flask.Flask:
+def get_optional_int(
+    config_dictionary: dict[str, str], key: str, default: int | None = None
+) -> int | None:
     """
-    Setup API and bind it to Flask app, define metrics, and logging.
+    Read integer value from configuration. Empty value or "0" means no value.
+    """
+    value = config_dictionary.get(key)
+    if value is None:
+        return default
+    if not value or int(value) == 0:
+        return None
+    return int(value)
+
+
+def get_language_router_kwargs(config_dictionary: dict[str, str]) -> dict[str, Any]:
+    """
+    Read configuration of per-language model executors.
+    """
+    supported_languages = config_dictionary.get("SUPPORTED_LANGUAGES")
+    timeout = config_dictionary.get("INFERENCE_TIMEOUT_SECONDS")
+    return {
+        "supported_languages": (
+            supported_languages.split(",") if supported_languages else None
+        ),
+        "max_workers": int(
+            config_dictionary.get(
+                "LANGUAGE_MODEL_WORKERS", DEFAULT_LANGUAGE_MODEL_WORKERS
+            )
+        ),
+        "max_queue_size": int(
+            config_dictionary.get(
+                "LANGUAGE_MODEL_QUEUE_SIZE", DEFAULT_LANGUAGE_MODEL_QUEUE_SIZE
+            )
+        ),
+        "timeout": float(timeout) if timeout else None,
+    }
+
+
+def create_language_router(config_dictionary: dict[str, str]) -> LanguageRouter | None:
+    """
+    Create router to per-language models if enabled in configuration.
+    """
+    if config_dictionary.get("LANGUAGE_ROUTING", "0") != "1":
+        return None
+    return LanguageRouter(
+        API.load_model, **get_language_router_kwargs(config_dictionary)
+    )
+
+
+def create_inference_client(
+    config_dictionary: dict[str, str],
+) -> InferenceClient | None:
+    """
+    Create client of inference process pool if the pool is configured.
+    """
+    socket_path = config_dictionary.get("INFERENCE_SOCKET_PATH")
+    if not socket_path:
+        return None
+    # pylint: disable=import-outside-toplevel
+    from api.inference_server import DEFAULT_CLIENT_TIMEOUT_SECONDS, InferenceClient
+
+    timeout = config_dictionary.get("INFERENCE_TIMEOUT_SECONDS")
+    return InferenceClient(
+        socket_path,
+        timeout=float(timeout) if timeout else DEFAULT_CLIENT_TIMEOUT_SECONDS,
+    )
+
+
+def create_inference_pool(config_dictionary: dict[str, str]) -> InferencePool:
     """
-    up_metric = Gauge("up", "1 if API is running.")
-    up_metric.set(1)
+    Create inference process pool serving HTTP workers on INFERENCE_SOCKET_PATH.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.inference_server import (
+        DEFAULT_MAX_BATCH_DELAY_SECONDS,
+        DEFAULT_MAX_BATCH_SIZE,
+        InferencePool,
+    )
+
+    language_router_kwargs = get_language_router_kwargs(config_dictionary)
+    timeout = language_router_kwargs.pop("timeout")
+    return InferencePool(
+        config_dictionary["INFERENCE_SOCKET_PATH"],
+        API.load_model,
+        processes=int(
+            config_dictionary.get("INFERENCE_PROCESSES", DEFAULT_INFERENCE_PROCESSES)
+        ),
+        language_router_kwargs=language_router_kwargs,
+        batcher_kwargs={
+            "max_batch_size": int(
+                config_dictionary.get(
+                    "INFERENCE_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE
+                )
+            ),
+            "max_batch_delay_seconds": float(
+                config_dictionary.get(
+                    "INFERENCE_MAX_BATCH_DELAY_SECONDS",
+                    DEFAULT_MAX_BATCH_DELAY_SECONDS,
+                )
+            ),
+        },
+        timeout=timeout,
+    )
+
 
-    endpoint_call_count_metric = Counter(
-        "endpoint_calls",
-        "How many times the endpoint was called.",
-        labelnames=["endpoint", "pid", "status_code"],
+def create_tracer(config_dictionary: dict[str, str]) -> Tracer | None:
+    """
+    Create tracer if sampling is enabled in configuration.
+    Spans are exported to TRACE_EXPORT_FILE, or to TRACE_EXPORT_ENDPOINT
+    in OTLP/HTTP JSON format. Sampled flag of incoming 'traceparent'
+    forces sampling only if TRACE_RESPECT_PARENT_SAMPLED is set.
+    """
+    sample_rate = float(config_dictionary.get("TRACE_SAMPLE_RATE", 0))
+    if sample_rate <= 0:
+        return None
+    export_file = config_dictionary.get("TRACE_EXPORT_FILE")
+    if export_file:
+        sink = FileSpanSink(export_file)
+    else:
+        sink = OTLPHTTPSpanSink(
+            config_dictionary.get("TRACE_EXPORT_ENDPOINT", DEFAULT_OTLP_ENDPOINT)
+        )
+    return Tracer(
+        sink,
+        sample_rate,
+        respect_parent_sampled=(
+            config_dictionary.get("TRACE_RESPECT_PARENT_SAMPLED", "0") == "1"
+        ),
     )
-    endpoint_duration_metric = Gauge(
-        "endpoint_duration_seconds",
-        "How long the endpoint took to respond.",
-        labelnames=["endpoint", "pid", "status_code"],
+
+
+def warm_up_api(
+    api_worker: API,
+    language_codes: list[str],
+    profiler: StartupProfiler,
+    timeout: float = DEFAULT_WARM_UP_TIMEOUT_SECONDS,
+) -> None:
+    """
+    Warm up API models, retry with exponential backoff if it fails
+    (e.g. inference pool is still starting). Stop retrying after
+    WARM_UP_ATTEMPTS attempts or once the next attempt would start
+    after timeout seconds.
+    Mark the API ready once it succeeds and failed otherwise.
+    Log durations of startup steps in both cases.
+    """
+    deadline = time.monotonic() + timeout
+    retry_delay = WARM_UP_RETRY_DELAY_SECONDS
+    attempt = 0
+    is_warm = False
+    with profiler.step("warm_up"):
+        while not is_warm:
+            attempt += 1
+            try:
+                api_worker.warm_up(language_codes)
+                is_warm = True
+            except Exception:  # pylint: disable=broad-except
+                api_worker.logger.exception("Warm-up attempt %s failed.", attempt)
+                if (
+                    attempt >= WARM_UP_ATTEMPTS
+                    or time.monotonic() + retry_delay >= deadline
+                ):
+                    break
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, WARM_UP_MAX_RETRY_DELAY_SECONDS)
+    if not is_warm:
+        api_worker.logger.error(
+            "Warm-up failed after %s attempts.",
+            attempt,
+            extra={"startup_seconds": profiler.report()},
+        )
+        api_worker.mark_failed()
+        return
+    api_worker.logger.info(
+        "Startup finished", extra={"startup_seconds": profiler.report()}
     )
+    api_worker.mark_ready()
+
+
+def create_app(
+    config_dictionary: dict[str, str] | None = None,
+    profiler: StartupProfiler | None = None,
+) -> flask.Flask:
+    """
+    Setup API and bind it to Flask app, define metrics, and logging.
+    Models are warmed up before the app is returned, so that gunicorn
+    workers accept requests only once warm (or failed, see "/status").
+    Warm-up takes at most WARM_UP_TIMEOUT_SECONDS, keep it below
+    gunicorn worker timeout.
+    """
+    profiler = profiler or StartupProfiler()
+    with profiler.step("metrics"):
+        up_metric = Gauge("up", "1 if API is running.", multiprocess_mode="livemax")
+        up_metric.set(1)
+
+        endpoint_call_count_metric = Counter(
+            "endpoint_calls",
+            "How many times the endpoint was called.",
+            labelnames=["endpoint", "pid", "status_code"],
+        )
+        endpoint_duration_metric = Gauge(
+            "endpoint_duration_seconds",
+            "How long the endpoint took to respond.",
+            labelnames=["endpoint", "pid", "status_code"],
+            multiprocess_mode="livemax",
+        )
+        metrics_exporter = MetricsExporter(
+            create_metrics_registry(),
+            cache_seconds=float(
+                config_dictionary.get(
+                    "METRICS_CACHE_SECONDS", DEFAULT_METRICS_CACHE_SECONDS
+                )
+            ),
+        )
 
-    models_dao = FileBasedDAO(data_directory=config_dictionary["DATA_DIRECTORY"])
-    logger = setup_logging(logging.INFO)
+    with profiler.step("dao"):
+        models_dao = FileBasedDAO(
+            data_directory=config_dictionary["DATA_DIRECTORY"],
+            shard_depth=int(config_dictionary.get("DATA_SHARD_DEPTH", 0)),
+        )
+    with profiler.step("logging"):
+        logger = setup_logging(logging.INFO)
+    with profiler.step("tracing"):
+        tracer = create_tracer(config_dictionary)
+
+    with profiler.step("api"):
+        api_worker = API(
+            models_dao,
+            logger,
+            max_text_length=get_optional_int(
+                config_dictionary, "MAX_TEXT_LENGTH", DEFAULT_MAX_TEXT_LENGTH
+            ),
+            inference_chunk_length=get_optional_int(
+                config_dictionary, "INFERENCE_CHUNK_LENGTH"
+            ),
+            language_router=create_language_router(config_dictionary),
+            inference_client=create_inference_client(config_dictionary),
+        )
+    warm_up_languages = config_dictionary.get(
+        "WARM_UP_LANGUAGES",
+        config_dictionary.get("SUPPORTED_LANGUAGES") or DEFAULT_WARM_UP_LANGUAGES,
+    )
+    warm_up_api(
+        api_worker,
+        warm_up_languages.split(","),
+        profiler,
+        float(
+            config_dictionary.get(
+                "WARM_UP_TIMEOUT_SECONDS", DEFAULT_WARM_UP_TIMEOUT_SECONDS
+            )
+        ),
+    )
 
-    api_worker = API(models_dao, logger)
     app = flask.Flask(APPLICATION_NAME)
+    # requests with larger body are rejected before the body is read
+    app.config["MAX_CONTENT_LENGTH"] = get_optional_int(
+        config_dictionary, "MAX_REQUEST_BYTES", DEFAULT_MAX_REQUEST_BYTES
+    )
     app.api_worker = api_worker
 
     @app.route("/")
@@ -53,27 +320,55 @@ def create_app(config_dictionary: dict[str, str] | None = None) -> flask.Flask:
         }, 200
 
     @app.route("/metrics")
-    def show_metrics() -> bytes:
-        return generate_latest()
+    def show_metrics() -> tuple[bytes, int, dict[str, str]]:
+        use_gzip = flask.request.accept_encodings["gzip"] > 0
+        exposition, headers = metrics_exporter.get_exposition(use_gzip)
+        return exposition, 200, headers
+
+    @app.route("/language_metrics")
+    def show_language_metrics() -> tuple[dict[str, dict], int]:
+        try:
+            return app.api_worker.get_language_metrics(), 200
+        except InferenceUnavailableException:
+            return {ERRORS_KEY: ["model unavailable"]}, 503
 
     @app.route("/status")
     def status():
-        up_metric.set(1)
+        # failed worker is reported down so that it gets restarted
+        if app.api_worker.has_failed:
+            return "Warm-up failed", 503
+        return "OK", 200
+
+    @app.route("/ready")
+    def ready():
+        if not app.api_worker.is_ready:
+            return "Not ready", 503
         return "OK", 200
 
     @app.route("/label_sentiment", methods=["POST"])
     def label_sentiment() -> tuple[dict[str, str], int]:
-        request_data = flask.request.get_json()
-        return app.api_worker.get_sentiment(request_data)
+        trace = flask.g.trace
+        with trace_span(trace, "parsing"):
+            request_data = flask.request.get_json()
+        return app.api_worker.get_sentiment(request_data, trace)
 
     @app.route("/save_sentiment", methods=["POST"])
     def save_sentiment() -> tuple[dict[str, str], int]:
-        request_data = flask.request.get_json()
-        return app.api_worker.save_sentiment(request_data)
+        trace = flask.g.trace
+        with trace_span(trace, "parsing"):
+            request_data = flask.request.get_json()
+        return app.api_worker.save_sentiment(request_data, trace)
+
+    @app.errorhandler(413)
+    def request_too_large(_error) -> tuple[dict[str, list[str]], int]:
+        return {ERRORS_KEY: ["request too large"]}, 413
 
     @app.before_request
     def before_request() -> None:
         flask.request.time_start = time.monotonic()
+        flask.g.trace = (
+            tracer.start_trace(flask.request.headers) if tracer is not None else None
+        )
 
     @app.after_request
     def log_after_request(response: flask.Response) -> flask.Response:
@@ -91,6 +386,18 @@ def create_app(config_dictionary: dict[str, str] | None = None) -> flask.Flask:
             "response_status_code": response.status_code,
             "response_duration_seconds": duration,
         }
+        trace = getattr(flask.g, "trace", None)
+        if trace is not None:
+            common_info["trace_id"] = trace.trace_id
+            response.headers[TRACE_ID_HEADER] = trace.trace_id
+            trace.finish(
+                "request",
+                {
+                    "http.method": flask.request.method,
+                    "http.route": flask.request.path,
+                    "http.status_code": response.status_code,
+                },
+            )
         app.api_worker.logger.info("Request", extra=common_info)
 
         if duration is not None:
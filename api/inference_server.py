@@ -0,0 +1,466 @@
+"""
+Module with a pool of inference processes that serve HTTP workers
+over a local Unix socket.
+HTTP workers hold no model, so their number can grow without growing
+model memory. Requests from all HTTP workers are batched together
+in the inference processes.
+
+The pool runs in its own supervisor process, e.g.:
+    INFERENCE_SOCKET_PATH=/tmp/inference.sock python -m api.inference_server
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable
+
+from api.language_routing import BatchModel, LanguageModelExecutor, LanguageRouter
+from common.exceptions import (
+    InferenceQueueFullException,
+    InferenceTimeoutException,
+    InferenceUnavailableException,
+)
+
+MESSAGE_HEADER = struct.Struct("!I")
+
+TEXTS_KEY = "texts"
+LANGUAGE_CODE_KEY = "languageCode"
+LABELS_KEY = "labels"
+METRICS_KEY = "metrics"
+ERROR_KEY = "error"
+
+QUEUE_FULL_ERROR = "queue full"
+TIMEOUT_ERROR = "timeout"
+INTERNAL_ERROR = "internal error"
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_BATCH_DELAY_SECONDS = 0.005
+# HTTP workers must not wait for gunicorn's worker timeout if the pool hangs
+DEFAULT_CLIENT_TIMEOUT_SECONDS = 10.0
+MONITOR_INTERVAL_SECONDS = 1.0
+
+
+def send_message(connection: socket.socket, message: dict[str, Any]) -> None:
+    """
+    Send length-prefixed JSON message.
+    """
+    payload = json.dumps(message).encode("utf-8")
+    connection.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes | None:
+    chunks = []
+    while size:
+        chunk = connection.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def receive_message(connection: socket.socket) -> dict[str, Any] | None:
+    """
+    Receive length-prefixed JSON message. Return None if connection was closed.
+    """
+    header = _receive_exactly(connection, MESSAGE_HEADER.size)
+    if header is None:
+        return None
+    payload = _receive_exactly(connection, MESSAGE_HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+
+def _set_future_result(future: Future, result: Any) -> None:
+    # future may have been cancelled after its client timed out
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _set_future_exception(future: Future, error: BaseException) -> None:
+    try:
+        future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+class InferenceBatcher:
+    """
+    Collects texts submitted from multiple connections into batches.
+    A batch is closed when it has max_batch_size texts or after max_batch_delay
+    seconds, then it is split by language and passed to the language models.
+    """
+
+    def __init__(
+        self,
+        language_router: LanguageRouter,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_batch_delay_seconds: float = DEFAULT_MAX_BATCH_DELAY_SECONDS,
+    ) -> None:
+        self.language_router = language_router
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay_seconds = max_batch_delay_seconds
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: list[str], language_code: str) -> Future:
+        """
+        Submit texts to be labelled in the next batch.
+        """
+        future = Future()
+        self._queue.put((texts, language_code, future))
+        return future
+
+    def _collect_batch(self) -> list[tuple[list[str], str, Future]]:
+        batch = [self._queue.get()]
+        text_count = len(batch[0][0])
+        deadline = time.monotonic() + self.max_batch_delay_seconds
+        while text_count < self.max_batch_size:
+            remaining_seconds = deadline - time.monotonic()
+            if remaining_seconds <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining_seconds)
+            except queue.Empty:
+                break
+            batch.append(item)
+            text_count += len(item[0])
+        return batch
+
+    @staticmethod
+    def _distribute_results(
+        model_future: Future, requests: list[tuple[list[str], Future]]
+    ) -> None:
+        if model_future.cancelled():
+            return
+        error = model_future.exception()
+        if error is not None:
+            for _, request_future in requests:
+                _set_future_exception(request_future, error)
+            return
+        labels = model_future.result()
+        start = 0
+        for texts, request_future in requests:
+            _set_future_result(request_future, labels[start : start + len(texts)])
+            start += len(texts)
+
+    def _run(self) -> None:
+        while True:
+            language_batches = {}
+            for texts, language_code, future in self._collect_batch():
+                routed_code = self.language_router.route(language_code)
+                language_batches.setdefault(routed_code, []).append((texts, future))
+            for routed_code, requests in language_batches.items():
+                # models are loaded outside of this thread, so that loading
+                # a new language does not stop batching of the loaded ones
+                executor_future = self.language_router.get_executor_future(routed_code)
+                executor_future.add_done_callback(
+                    functools.partial(self._submit_batch, requests=requests)
+                )
+
+    @staticmethod
+    def _cancel_if_abandoned(
+        _request_future: Future,
+        executor: LanguageModelExecutor,
+        model_future: Future,
+        requests: list[tuple[list[str], Future]],
+    ) -> None:
+        # do not run batch whose requests all timed out, free its queue slot
+        if all(request_future.cancelled() for _, request_future in requests):
+            executor.cancel(model_future)
+
+    def _submit_batch(
+        self, executor_future: Future, requests: list[tuple[list[str], Future]]
+    ) -> None:
+        # requests cancelled on timeout are not labelled
+        requests = [
+            (texts, request_future)
+            for texts, request_future in requests
+            if not request_future.cancelled()
+        ]
+        if not requests:
+            return
+        try:
+            executor = executor_future.result()
+            model_future = executor.submit(
+                [text for texts, _ in requests for text in texts]
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            for _, request_future in requests:
+                _set_future_exception(request_future, error)
+            return
+        model_future.add_done_callback(
+            functools.partial(self._distribute_results, requests=requests)
+        )
+        cancel_if_abandoned = functools.partial(
+            self._cancel_if_abandoned,
+            executor=executor,
+            model_future=model_future,
+            requests=requests,
+        )
+        for _, request_future in requests:
+            request_future.add_done_callback(cancel_if_abandoned)
+
+
+def _handle_connection(
+    connection: socket.socket,
+    batcher: InferenceBatcher,
+    timeout: float | None,
+    logger: logging.Logger,
+) -> None:
+    with connection:
+        while True:
+            request = receive_message(connection)
+            if request is None:
+                return
+            if request.get(METRICS_KEY):
+                send_message(
+                    connection, {METRICS_KEY: batcher.language_router.get_metrics()}
+                )
+                continue
+            future = batcher.submit(request[TEXTS_KEY], request[LANGUAGE_CODE_KEY])
+            try:
+                response = {LABELS_KEY: future.result(timeout=timeout)}
+            except InferenceQueueFullException:
+                response = {ERROR_KEY: QUEUE_FULL_ERROR}
+            except FutureTimeoutError:
+                # do not label texts the client no longer waits for
+                future.cancel()
+                response = {ERROR_KEY: TIMEOUT_ERROR}
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Inference failed.")
+                response = {ERROR_KEY: INTERNAL_ERROR}
+            send_message(connection, response)
+
+
+def serve_inference(
+    listening_socket: socket.socket,
+    model_loader: Callable[[str], BatchModel],
+    language_router_kwargs: dict[str, Any],
+    batcher_kwargs: dict[str, Any],
+    timeout: float | None = None,
+) -> None:
+    """
+    Accept connections on listening_socket and label texts received on them.
+    Run in each inference process; models are loaded within the process.
+    """
+    # do not inherit signal handlers of the parent, so that terminate() stops us
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, signal.SIG_DFL)
+    logger = logging.getLogger(__name__)
+    language_router = LanguageRouter(model_loader, **language_router_kwargs)
+    batcher = InferenceBatcher(language_router, **batcher_kwargs)
+    while True:
+        connection, _ = listening_socket.accept()
+        threading.Thread(
+            target=_handle_connection,
+            args=(connection, batcher, timeout, logger),
+            daemon=True,
+        ).start()
+
+
+class InferencePool:
+    """
+    A pool of inference processes sharing one listening Unix socket.
+    A monitor thread replaces processes that die. The monitor can only
+    see its own children, so the pool must run in a process that does
+    not reap or fork other processes, see main (not in gunicorn master).
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        model_loader: Callable[[str], BatchModel],
+        processes: int = 1,
+        language_router_kwargs: dict[str, Any] | None = None,
+        batcher_kwargs: dict[str, Any] | None = None,
+        timeout: float | None = None,
+    ) -> None:
+        self.socket_path = socket_path
+        self.model_loader = model_loader
+        self.processes = processes
+        self.language_router_kwargs = language_router_kwargs or {}
+        self.batcher_kwargs = batcher_kwargs or {}
+        self.timeout = timeout
+        self._listening_socket = None
+        self._processes = []
+        self._logger = logging.getLogger(__name__)
+        self._stopped = threading.Event()
+        self._monitor_thread = None
+
+    def _start_process(self) -> multiprocessing.Process:
+        process = multiprocessing.Process(
+            target=serve_inference,
+            args=(
+                self._listening_socket,
+                self.model_loader,
+                self.language_router_kwargs,
+                self.batcher_kwargs,
+                self.timeout,
+            ),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _monitor(self) -> None:
+        while not self._stopped.wait(MONITOR_INTERVAL_SECONDS):
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stopped.is_set():
+                    continue
+                self._logger.error(
+                    "Inference process %s exited with code %s, restarting.",
+                    process.pid,
+                    process.exitcode,
+                )
+                self._processes[index] = self._start_process()
+
+    def start(self) -> None:
+        """
+        Bind the socket, start inference processes and their monitor.
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._listening_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listening_socket.bind(self.socket_path)
+        self._listening_socket.listen()
+        self._stopped.clear()
+        self._processes = [self._start_process() for _ in range(self.processes)]
+        self._monitor_thread = threading.Thread(target=self._monitor, daemon=True)
+        self._monitor_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop inference processes and remove the socket.
+        """
+        self._stopped.set()
+        if self._monitor_thread is not None:
+            self._monitor_thread.join()
+            self._monitor_thread = None
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        if self._listening_socket is not None:
+            self._listening_socket.close()
+            self._listening_socket = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class InferenceClient:
+    """
+    Forwards texts from an HTTP worker to the inference pool.
+    Each thread keeps its own connection to the pool.
+    """
+
+    def __init__(
+        self, socket_path: str, timeout: float = DEFAULT_CLIENT_TIMEOUT_SECONDS
+    ) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_connection(self) -> socket.socket:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            self._local.connection = connection
+        return connection
+
+    def _close_connection(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _request(self, message: dict[str, Any]) -> dict[str, Any]:
+        # a kept connection may have been closed by a restarted pool, retry once
+        is_new_connection = getattr(self._local, "connection", None) is None
+        try:
+            connection = self._get_connection()
+            send_message(connection, message)
+            response = receive_message(connection)
+        except socket.timeout as error:
+            # response could still arrive, connection cannot be reused
+            self._close_connection()
+            raise InferenceTimeoutException(self.socket_path) from error
+        except OSError as error:
+            self._close_connection()
+            if is_new_connection:
+                raise InferenceUnavailableException(self.socket_path) from error
+            return self._request(message)
+        if response is None:
+            self._close_connection()
+            if is_new_connection:
+                raise InferenceUnavailableException(
+                    f"Inference pool closed connection: {self.socket_path}"
+                )
+            return self._request(message)
+        return response
+
+    def label(self, texts: list[str], language_code: str) -> list[str]:
+        """
+        Label texts by the inference pool and wait for the result.
+        """
+        response = self._request({TEXTS_KEY: texts, LANGUAGE_CODE_KEY: language_code})
+        error = response.get(ERROR_KEY)
+        if error == QUEUE_FULL_ERROR:
+            raise InferenceQueueFullException(language_code)
+        if error == TIMEOUT_ERROR:
+            raise InferenceTimeoutException(language_code)
+        if error is not None:
+            raise InferenceUnavailableException(error)
+        return response[LABELS_KEY]
+
+    def get_metrics(self) -> dict[str, dict[str, Any]]:
+        """
+        Return language model metrics of the inference process
+        this thread is connected to. Metrics are not aggregated,
+        with multiple inference processes each call may show another process.
+        """
+        return self._request({METRICS_KEY: True})[METRICS_KEY]
+
+
+def main() -> None:
+    """
+    Run inference pool configured from the environment until SIGTERM or SIGINT.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.flask_app import create_inference_pool
+    from common.log import setup_logging
+
+    setup_logging(logging.INFO)
+    stopped = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stopped.set())
+    pool = create_inference_pool(os.environ.copy())
+    pool.start()
+    try:
+        while not stopped.wait(MONITOR_INTERVAL_SECONDS):
+            pass
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Module for routing inference requests to per-language models.
+Each model runs in its own executor with bounded concurrency and queue,
+so that a slow model of one language does not slow down the others.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Generic, TypeVar
+
+from common.exceptions import InferenceQueueFullException, InferenceTimeoutException
+
+LabelType = TypeVar("LabelType")
+BatchModel = Callable[[list[str]], list[LabelType]]
+
+DEFAULT_LANGUAGE_CODE = "default"
+
+LANGUAGE_CODE_SEPARATOR_PATTERN = re.compile("[-_]")
+
+
+def normalize_language_code(language_code: str) -> str:
+    """
+    Normalize language code to lowercase primary language subtag,
+    e.g. "EN", "en-US" and "en_gb" all become "en".
+    """
+    primary_subtag = LANGUAGE_CODE_SEPARATOR_PATTERN.split(language_code.strip(), 1)[0]
+    return primary_subtag.lower() or DEFAULT_LANGUAGE_CODE
+
+
+class LanguageModelExecutor(Generic[LabelType]):
+    """
+    Runs batches through a single model in a dedicated thread pool.
+    At most max_workers batches run concurrently and at most max_queue_size
+    batches wait, further batches are rejected.
+    """
+
+    def __init__(
+        self,
+        language_code: str,
+        model: BatchModel,
+        max_workers: int = 1,
+        max_queue_size: int = 32,
+    ) -> None:
+        self.language_code = language_code
+        self.model = model
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"model-{language_code}"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._lock = threading.Lock()
+        self._in_flight_count = 0
+        self._running_count = 0
+        self._completed_count = 0
+        self._rejected_count = 0
+        self._cancelled_count = 0
+        self._total_latency_seconds = 0.0
+        self._total_queue_seconds = 0.0
+
+    def _run(self, texts: list[str], time_submitted: float) -> list[LabelType]:
+        time_started = time.monotonic()
+        with self._lock:
+            self._running_count += 1
+            self._total_queue_seconds += time_started - time_submitted
+        try:
+            return self.model(texts)
+        finally:
+            time_finished = time.monotonic()
+            with self._lock:
+                self._running_count -= 1
+                self._in_flight_count -= 1
+                self._completed_count += 1
+                self._total_latency_seconds += time_finished - time_submitted
+            self._slots.release()
+
+    def submit(self, texts: list[str]) -> Future:
+        """
+        Submit texts to be labelled with the model without waiting for the result.
+        Raise InferenceQueueFullException if the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected_count += 1
+            raise InferenceQueueFullException(self.language_code)
+        with self._lock:
+            self._in_flight_count += 1
+        return self._executor.submit(self._run, texts, time.monotonic())
+
+    def cancel(self, future: Future) -> bool:
+        """
+        Cancel batch submitted by submit if it has not started running yet.
+        Return True if it was cancelled.
+        """
+        with self._lock:
+            if future.cancelled() or not future.cancel():
+                return False
+            # _run will never execute, free its queue slot here
+            self._in_flight_count -= 1
+            self._cancelled_count += 1
+        self._slots.release()
+        return True
+
+    def label(self, texts: list[str], timeout: float | None = None) -> list[LabelType]:
+        """
+        Label texts with the model and wait for the result.
+        Raise InferenceQueueFullException if the queue is full
+        and InferenceTimeoutException if the result is not ready in time,
+        the batch is then cancelled if it is still waiting in the queue.
+        """
+        future = self.submit(texts)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError as error:
+            self.cancel(future)
+            raise InferenceTimeoutException(self.language_code) from error
+
+    def get_metrics(self) -> dict[str, float | int]:
+        """
+        Return queue and latency statistics of the executor.
+        """
+        with self._lock:
+            completed_count = self._completed_count
+            return {
+                "queue_size": self._in_flight_count - self._running_count,
+                "running": self._running_count,
+                "completed": completed_count,
+                "rejected": self._rejected_count,
+                "cancelled": self._cancelled_count,
+                "mean_latency_seconds": (
+                    self._total_latency_seconds / completed_count
+                    if completed_count
+                    else 0.0
+                ),
+                "mean_queue_seconds": (
+                    self._total_queue_seconds / completed_count
+                    if completed_count
+                    else 0.0
+                ),
+            }
+
+    def shutdown(self) -> None:
+        """
+        Stop the executor after running batches finish.
+        """
+        self._executor.shutdown(wait=True)
+
+
+class LanguageRouter(Generic[LabelType]):
+    """
+    Routes texts to per-language model executors.
+    Models are loaded lazily by model_loader on first use of the language.
+    If supported_languages is given, other languages use a shared default model.
+    """
+
+    def __init__(
+        self,
+        model_loader: Callable[[str], BatchModel],
+        supported_languages: list[str] | None = None,
+        max_workers: int = 1,
+        max_queue_size: int = 32,
+        timeout: float | None = None,
+    ) -> None:
+        self.model_loader = model_loader
+        self.supported_languages = (
+            None
+            if supported_languages is None
+            else {normalize_language_code(code) for code in supported_languages}
+        )
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self._executors: dict[str, LanguageModelExecutor[LabelType]] = {}
+        self._executor_futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def route(self, language_code: str) -> str:
+        """
+        Return code of the language whose model labels texts in language_code.
+        """
+        normalized_code = normalize_language_code(language_code)
+        if (
+            self.supported_languages is not None
+            and normalized_code not in self.supported_languages
+        ):
+            return DEFAULT_LANGUAGE_CODE
+        return normalized_code
+
+    def _load_executor(self, routed_code: str, executor_future: Future) -> None:
+        try:
+            executor = LanguageModelExecutor(
+                routed_code,
+                self.model_loader(routed_code),
+                self.max_workers,
+                self.max_queue_size,
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            with self._lock:
+                # let the next request retry loading
+                del self._executor_futures[routed_code]
+            executor_future.set_exception(error)
+            return
+        with self._lock:
+            self._executors[routed_code] = executor
+        executor_future.set_result(executor)
+
+    def get_executor_future(self, language_code: str) -> Future:
+        """
+        Return future of executor for language without waiting for it.
+        Models are loaded in their own threads, so loading a slow model
+        does not delay other languages.
+        """
+        routed_code = self.route(language_code)
+        with self._lock:
+            executor_future = self._executor_futures.get(routed_code)
+            if executor_future is not None:
+                return executor_future
+            executor_future = Future()
+            self._executor_futures[routed_code] = executor_future
+        threading.Thread(
+            target=self._load_executor,
+            args=(routed_code, executor_future),
+            name=f"load-model-{routed_code}",
+            daemon=True,
+        ).start()
+        return executor_future
+
+    def get_executor(self, language_code: str) -> LanguageModelExecutor[LabelType]:
+        """
+        Return executor for language, wait for its model to load if not loaded yet.
+        """
+        executor = self._executors.get(self.route(language_code))
+        if executor is not None:
+            return executor
+        return self.get_executor_future(language_code).result()
+
+    def label(self, texts: list[str], language_code: str) -> list[LabelType]:
+        """
+        Label texts with the model for given language.
+        """
+        return self.get_executor(language_code).label(texts, self.timeout)
+
+    def get_metrics(self) -> dict[str, dict[str, Any]]:
+        """
+        Return queue and latency statistics for each loaded language.
+        """
+        return {
+            language_code: executor.get_metrics()
+            for language_code, executor in list(self._executors.items())
+        }
+
+    def shutdown(self) -> None:
+        """
+        Stop all executors.
+        """
+        for executor in list(self._executors.values()):
+            executor.shutdown()
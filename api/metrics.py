@@ -0,0 +1,96 @@
+"""
+Module for serving Prometheus metrics aggregated across all worker processes.
+"""
+
+from __future__ import annotations
+
+import gzip
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
+
+MULTIPROCESS_DIRECTORY_KEY = "PROMETHEUS_MULTIPROC_DIR"
+
+DEFAULT_METRICS_CACHE_SECONDS = 1.0
+
+
+def create_metrics_registry() -> CollectorRegistry:
+    """
+    Return registry with metrics of all worker processes if
+    PROMETHEUS_MULTIPROC_DIR is set (must be set before the
+    workers start), otherwise the default per-process registry.
+    """
+    if not os.environ.get(MULTIPROCESS_DIRECTORY_KEY):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def clear_multiprocess_directory() -> None:
+    """
+    Remove metric files left by previous runs. Call before workers start.
+    """
+    directory = os.environ.get(MULTIPROCESS_DIRECTORY_KEY)
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith(".db"):
+            os.unlink(os.path.join(directory, filename))
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Remove live gauges of a finished worker process.
+    """
+    if os.environ.get(MULTIPROCESS_DIRECTORY_KEY):
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsExporter:
+    """
+    Serializes metrics of a registry. Serialized metrics are cached for
+    cache_seconds so that frequent scrapes do not recollect all metrics.
+    """
+
+    def __init__(
+        self,
+        registry: CollectorRegistry,
+        cache_seconds: float = DEFAULT_METRICS_CACHE_SECONDS,
+    ) -> None:
+        self.registry = registry
+        self.cache_seconds = cache_seconds
+        self._lock = threading.Lock()
+        self._cached_at = None
+        self._exposition = b""
+        self._gzipped_exposition = None
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if self._cached_at is not None and now - self._cached_at < self.cache_seconds:
+            return
+        self._exposition = generate_latest(self.registry)
+        self._gzipped_exposition = None
+        self._cached_at = now
+
+    def get_exposition(self, use_gzip: bool = False) -> tuple[bytes, dict[str, str]]:
+        """
+        Return serialized (and optionally gzipped) metrics and response headers.
+        """
+        headers = {"Content-Type": CONTENT_TYPE_LATEST, "Vary": "Accept-Encoding"}
+        with self._lock:
+            self._refresh()
+            if not use_gzip:
+                return self._exposition, headers
+            if self._gzipped_exposition is None:
+                self._gzipped_exposition = gzip.compress(self._exposition)
+            headers["Content-Encoding"] = "gzip"
+            return self._gzipped_exposition, headers
@@ -7,12 +7,23 @@ from __future__ import annotations
 import logging
 import random
 from enum import Enum
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 from pydantic import BaseModel, Field, ValidationError
 
+from api.language_routing import BatchModel, LanguageRouter
+from api.tracing import Trace, trace_span
 from common.daos.file_based_dao import FileBasedDAO
-from common.exceptions import DuplicateItemException
+from common.exceptions import (
+    DuplicateItemException,
+    InferenceQueueFullException,
+    InferenceTimeoutException,
+    InferenceUnavailableException,
+)
+
+if TYPE_CHECKING:
+    # imported only for annotations, the client is created by the caller
+    from api.inference_server import InferenceClient
 
 TEXT_KEY = "text"
 LANGUAGE_CODE_KEY = "languageCode"
@@ -21,6 +32,8 @@ TRANSLATION_QUALITY_KEY = "isGoodTranslation"
 
 ERRORS_KEY = "errors"
 
+WARM_UP_TEXTS = ["This is a warm-up text.", "Another one, a bit longer warm-up text."]
+
 
 class SentimentValue(str, Enum):
     """
@@ -32,6 +45,15 @@ class SentimentValue(str, Enum):
     NEGATIVE = "negative"
 
 
+SENTIMENT_SCORES = {
+    SentimentValue.POSITIVE: 1,
+    SentimentValue.NEUTRAL: 0,
+    SentimentValue.NEGATIVE: -1,
+}
+# mean chunk score must exceed this to label text as positive / negative
+SENTIMENT_SCORE_THRESHOLD = 1 / 3
+
+
 class SentimentRatingItem(BaseModel):
     """
     A class for parsing sentiment labelling request.
@@ -50,15 +72,120 @@ class SentimentSavingItem(SentimentRatingItem):
     is_good_translation: bool = Field(alias="isGoodTranslation")
 
 
+def _find_split_index(text: str, chunk_length: int) -> int:
+    # last whitespace that keeps the chunk within chunk_length
+    for index in range(chunk_length, 0, -1):
+        if text[index].isspace():
+            return index
+    return chunk_length
+
+
+def split_text_into_chunks(text: str, chunk_length: int) -> list[str]:
+    """
+    Split text into non-empty chunks of at most chunk_length characters.
+    Prefer splitting at whitespace so that words are not cut in half.
+    """
+    chunks = []
+    text = text.strip()
+    while len(text) > chunk_length:
+        split_index = _find_split_index(text, chunk_length)
+        chunks.append(text[:split_index].rstrip())
+        text = text[split_index:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+def aggregate_sentiments(
+    sentiments: list[SentimentValue], weights: list[int]
+) -> SentimentValue:
+    """
+    Aggregate sentiments of text chunks into sentiment of the whole text.
+    Each chunk's sentiment score is weighted (e.g. by chunk length).
+    """
+    total_weight = sum(weights)
+    if total_weight == 0:
+        return SentimentValue.NEUTRAL
+    mean_score = (
+        sum(
+            SENTIMENT_SCORES[sentiment] * weight
+            for sentiment, weight in zip(sentiments, weights)
+        )
+        / total_weight
+    )
+    if mean_score > SENTIMENT_SCORE_THRESHOLD:
+        return SentimentValue.POSITIVE
+    if mean_score < -SENTIMENT_SCORE_THRESHOLD:
+        return SentimentValue.NEGATIVE
+    return SentimentValue.NEUTRAL
+
+
 class API:
     """
     API for handling sentiment labelling and saving its results.
     Independent of framework (can be bound e.g. to Flask app).
     """
 
-    def __init__(self, models_dao: FileBasedDAO, logger: logging.Logger) -> None:
+    def __init__(
+        self,
+        models_dao: FileBasedDAO,
+        logger: logging.Logger,
+        max_text_length: int | None = None,
+        inference_chunk_length: int | None = None,
+        language_router: LanguageRouter[SentimentValue] | None = None,
+        inference_client: InferenceClient | None = None,
+    ) -> None:
+        """
+        Texts longer than max_text_length are rejected.
+        If inference_chunk_length is set, texts longer than that
+        are split into chunks that are labelled as a batch.
+        If language_router is set, texts are labelled by per-language
+        models in their own executors, otherwise in the calling thread.
+        If inference_client is set, texts are labelled by a separate
+        inference process pool instead.
+        """
         self.models_dao = models_dao
         self.logger = logger
+        self.max_text_length = max_text_length
+        self.inference_chunk_length = inference_chunk_length
+        self.language_router = language_router
+        self.inference_client = inference_client
+        self._ready = False
+        self._failed = False
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        True once models are loaded and warmed up.
+        """
+        return self._ready
+
+    @property
+    def has_failed(self) -> bool:
+        """
+        True if models could not be loaded or warmed up.
+        """
+        return self._failed
+
+    def mark_ready(self) -> None:
+        """
+        Mark API as ready to serve requests.
+        """
+        self._ready = True
+
+    def mark_failed(self) -> None:
+        """
+        Mark API as unable to serve requests because warm-up failed.
+        """
+        self._failed = True
+
+    def warm_up(self, language_codes: list[str]) -> None:
+        """
+        Load models for given languages and label a few texts
+        so that first requests do not pay for model initialization.
+        """
+        for language_code in language_codes:
+            self._label_sentiment_batch(WARM_UP_TEXTS, language_code)
 
     @staticmethod
     def _label_sentiment(
@@ -73,43 +200,139 @@ class API:
             [SentimentValue.POSITIVE, SentimentValue.NEUTRAL, SentimentValue.NEGATIVE]
         )
 
+    @staticmethod
+    def load_model(
+        language_code: str,  # pylint: disable=unused-argument
+    ) -> BatchModel:
+        """
+        Load model labelling sentiment of texts in given language.
+        Proper implementation would load a language specific model.
+        This one labels each text by _label_sentiment.
+        """
+        return lambda input_texts: [
+            API._label_sentiment(input_text) for input_text in input_texts
+        ]
+
+    def _label_sentiment_batch(
+        self, input_texts: list[str], language_code: str
+    ) -> list[SentimentValue]:
+        """
+        Label sentiment of multiple texts at once.
+        Proper implementation would run the model on the whole batch.
+        """
+        if self.inference_client is not None:
+            return [
+                SentimentValue(label)
+                for label in self.inference_client.label(input_texts, language_code)
+            ]
+        if self.language_router is not None:
+            return self.language_router.label(input_texts, language_code)
+        return [self._label_sentiment(input_text) for input_text in input_texts]
+
+    def _label_sentiment_chunked(
+        self, input_text: str, language_code: str
+    ) -> SentimentValue:
+        """
+        Label sentiment of a text that can be arbitrarily long.
+        Long texts are split into chunks, labelled as a batch,
+        and the results are aggregated.
+        """
+        if (
+            self.inference_chunk_length is None
+            or len(input_text) <= self.inference_chunk_length
+        ):
+            return self._label_sentiment_batch([input_text], language_code)[0]
+        chunks = split_text_into_chunks(input_text, self.inference_chunk_length)
+        sentiments = self._label_sentiment_batch(chunks, language_code)
+        return aggregate_sentiments(sentiments, [len(chunk) for chunk in chunks])
+
+    def get_language_metrics(self) -> dict[str, dict[str, Any]]:
+        """
+        Return queue and latency statistics of per-language models.
+        """
+        if self.inference_client is not None:
+            return self.inference_client.get_metrics()
+        if self.language_router is None:
+            return {}
+        return self.language_router.get_metrics()
+
+    def _is_text_too_long(self, text: str) -> bool:
+        return self.max_text_length is not None and len(text) > self.max_text_length
+
     def get_sentiment(
-        self, request_data: dict[str, Any]
+        self, request_data: dict[str, Any], trace: Trace | None = None
     ) -> tuple[dict[str, str | list[str]], int]:
         """
         Process text from request_data dictionary and return
         a dictionary with labelled sentiment and status code.
-        Return errors if request does not include required fields
-        or if the fields cannot be parsed to appropriate data types.
+        Return errors if request does not include required fields,
+        if the fields cannot be parsed to appropriate data types,
+        if the text is too long, or if the model is overloaded or unavailable.
+        Record spans of processing steps if trace is given.
         """
         try:
-            rating_input = SentimentRatingItem.parse_obj(request_data)
+            with trace_span(trace, "validation"):
+                rating_input = SentimentRatingItem.parse_obj(request_data)
         except ValidationError as error:
             self.logger.warning(
                 "Invalid input for sentiment labelling. Received: %s", request_data
             )
             return {ERRORS_KEY: error.errors()}, 400
-        return {SENTIMENT_KEY: self._label_sentiment(rating_input.text)}, 200
+        if self._is_text_too_long(rating_input.text):
+            self.logger.warning(
+                "Too long text for sentiment labelling. Length: %s",
+                len(rating_input.text),
+            )
+            return {ERRORS_KEY: ["text too long"]}, 413
+        try:
+            with trace_span(trace, "inference"):
+                sentiment = self._label_sentiment_chunked(
+                    rating_input.text, rating_input.language_code
+                )
+        except (InferenceQueueFullException, InferenceTimeoutException) as error:
+            self.logger.warning(
+                "Model overloaded. Language: %s, error: %r",
+                rating_input.language_code,
+                error,
+            )
+            return {ERRORS_KEY: ["model overloaded"]}, 503
+        except InferenceUnavailableException as error:
+            self.logger.error(
+                "Model unavailable. Language: %s, error: %r",
+                rating_input.language_code,
+                error,
+            )
+            return {ERRORS_KEY: ["model unavailable"]}, 503
+        return {SENTIMENT_KEY: sentiment}, 200
 
     def save_sentiment(
-        self, request_data: dict[str, Any]
+        self, request_data: dict[str, Any], trace: Trace | None = None
     ) -> tuple[dict[str, str | list[str]], int]:
         """
         Proces sentiment labeling result from request_data dictionary
         and save it.
         Return errors if request does not include required fields
         or if the fields cannot be parsed to appropriate data types,
-        or if the requested item is already saved.
+        if the text is too long, or if the requested item is already saved.
+        Record spans of processing steps if trace is given.
         """
         try:
-            saving_input = SentimentSavingItem.parse_obj(request_data)
+            with trace_span(trace, "validation"):
+                saving_input = SentimentSavingItem.parse_obj(request_data)
         except ValidationError as error:
             self.logger.warning(
                 "Invalid input for sentiment saving. Received: %s", request_data
             )
             return {ERRORS_KEY: error.errors()}, 400
+        if self._is_text_too_long(saving_input.text):
+            self.logger.warning(
+                "Too long text for sentiment saving. Length: %s",
+                len(saving_input.text),
+            )
+            return {ERRORS_KEY: ["text too long"]}, 413
         try:
-            self.models_dao.save_scoring_result(saving_input.dict(by_alias=True))
+            with trace_span(trace, "dao_write"):
+                self.models_dao.save_scoring_result(saving_input.dict(by_alias=True))
         except DuplicateItemException:
             return {ERRORS_KEY: ["item already exists"]}, 409
         return {}, 201
@@ -0,0 +1,69 @@
+"""
+Module for measuring how long application startup takes.
+
+Run e.g. in CI to report boot time including model warm-up:
+    DATA_DIRECTORY=data/ python -m api.startup
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import Iterator
+
+TOTAL_STEP = "total"
+
+
+class StartupProfiler:
+    """
+    Records durations of named startup steps.
+    """
+
+    def __init__(self) -> None:
+        self.step_durations: dict[str, float] = {}
+        self._time_start = time.monotonic()
+
+    @contextlib.contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """
+        Measure duration of the code run within the context.
+        """
+        time_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.step_durations[name] = time.monotonic() - time_start
+
+    def report(self) -> dict[str, float]:
+        """
+        Return durations of all finished steps and time since profiler creation.
+        """
+        return {
+            **self.step_durations,
+            TOTAL_STEP: time.monotonic() - self._time_start,
+        }
+
+
+def main() -> None:
+    """
+    Create app from environment, including warm-up,
+    and print durations of startup steps in JSON format.
+    Exit with non-zero code if warm-up fails or does not finish
+    within WARM_UP_TIMEOUT_SECONDS.
+    """
+    profiler = StartupProfiler()
+    with profiler.step("import"):
+        # pylint: disable=import-outside-toplevel
+        from api.flask_app import create_app
+
+    app = create_app(os.environ.copy(), profiler)
+    print(json.dumps(profiler.report()))
+    if not app.api_worker.is_ready:
+        sys.exit("Warm-up failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Module for lightweight request tracing.
+Sampled requests record spans that are exported in batches
+from a background thread to a pluggable sink.
+Requests that are not sampled record nothing.
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from typing import Any, ContextManager, Iterator, Mapping
+
+from common.constants import APPLICATION_NAME
+
+TRACEPARENT_HEADER = "traceparent"
+TRACE_ID_HEADER = "X-Trace-Id"
+
+# https://www.w3.org/TR/trace-context/#traceparent-header
+TRACEPARENT_PATTERN = re.compile(
+    r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$"
+)
+TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+SAMPLED_FLAG = 0x01
+
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+DEFAULT_MAX_QUEUE_SIZE = 10_000
+DEFAULT_SHUTDOWN_TIMEOUT_SECONDS = 5.0
+DEFAULT_OTLP_ENDPOINT = "http://localhost:4318/v1/traces"
+
+NO_OP_SPAN = contextlib.nullcontext()
+
+
+def _new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+def _new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+
+class Trace:
+    """
+    Spans of a single sampled request.
+    """
+
+    def __init__(
+        self, tracer: Tracer, trace_id: str, parent_span_id: str | None = None
+    ) -> None:
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.parent_span_id = parent_span_id
+        self.root_span_id = _new_span_id()
+        self.start_time_unix_nano = time.time_ns()
+        self.spans: list[dict[str, Any]] = []
+
+    def _record_span(
+        self,
+        name: str,
+        span_id: str,
+        parent_span_id: str | None,
+        start_time_unix_nano: int,
+        attributes: dict[str, Any] | None = None,
+    ) -> None:
+        self.spans.append(
+            {
+                "trace_id": self.trace_id,
+                "span_id": span_id,
+                "parent_span_id": parent_span_id,
+                "name": name,
+                "start_time_unix_nano": start_time_unix_nano,
+                "end_time_unix_nano": time.time_ns(),
+                "attributes": attributes or {},
+            }
+        )
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Record span of the code run within the context as a child of the request.
+        """
+        start_time_unix_nano = time.time_ns()
+        try:
+            yield
+        finally:
+            self._record_span(
+                name, _new_span_id(), self.root_span_id, start_time_unix_nano
+            )
+
+    def finish(self, name: str, attributes: dict[str, Any] | None = None) -> None:
+        """
+        Record span of the whole request and pass all spans to export.
+        """
+        self._record_span(
+            name,
+            self.root_span_id,
+            self.parent_span_id,
+            self.start_time_unix_nano,
+            attributes,
+        )
+        self.tracer.export(self.spans)
+
+
+def trace_span(trace: Trace | None, name: str) -> ContextManager[None]:
+    """
+    Return context recording span in trace, or a no-op context if not traced.
+    """
+    if trace is None:
+        return NO_OP_SPAN
+    return trace.span(name)
+
+
+class FileSpanSink:
+    """
+    Appends spans to a file as JSON lines.
+    Each batch is appended by a single write, so batches exported
+    by multiple worker processes do not interleave.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def export(self, spans: list[dict[str, Any]]) -> None:
+        """
+        Write spans to the file.
+        """
+        data = "".join(f"{json.dumps(span)}\n" for span in spans).encode("utf-8")
+        file_descriptor = os.open(
+            self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+        try:
+            os.write(file_descriptor, data)
+        finally:
+            os.close(file_descriptor)
+
+
+class OTLPHTTPSpanSink:
+    """
+    Posts spans in OTLP/HTTP JSON format to a (local) collector.
+    """
+
+    def __init__(
+        self, endpoint: str = DEFAULT_OTLP_ENDPOINT, timeout: float = 5.0
+    ) -> None:
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    @staticmethod
+    def _to_otlp_attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+        return [
+            {"key": key, "value": {"stringValue": str(value)}}
+            for key, value in attributes.items()
+        ]
+
+    @classmethod
+    def to_otlp(cls, spans: list[dict[str, Any]]) -> dict[str, Any]:
+        """
+        Convert spans to OTLP JSON payload.
+        """
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": cls._to_otlp_attributes(
+                            {"service.name": APPLICATION_NAME}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": APPLICATION_NAME},
+                            "spans": [
+                                {
+                                    "traceId": span["trace_id"],
+                                    "spanId": span["span_id"],
+                                    "parentSpanId": span["parent_span_id"] or "",
+                                    "name": span["name"],
+                                    "startTimeUnixNano": str(
+                                        span["start_time_unix_nano"]
+                                    ),
+                                    "endTimeUnixNano": str(span["end_time_unix_nano"]),
+                                    "attributes": cls._to_otlp_attributes(
+                                        span["attributes"]
+                                    ),
+                                }
+                                for span in spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, spans: list[dict[str, Any]]) -> None:
+        """
+        Post spans to the collector.
+        """
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(self.to_otlp(spans)).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class Tracer:
+    """
+    Samples requests and exports their spans in batches from a background thread.
+    If the export queue is full, spans are dropped instead of blocking requests,
+    dropped spans are logged by the export thread.
+    Queued spans are exported on interpreter exit.
+    """
+
+    def __init__(
+        self,
+        sink: Any,
+        sample_rate: float,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval_seconds: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        respect_parent_sampled: bool = False,
+    ) -> None:
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.respect_parent_sampled = respect_parent_sampled
+        self.dropped_span_count = 0
+        self._reported_dropped_span_count = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._logger = logging.getLogger(APPLICATION_NAME)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.shutdown)
+
+    def _ensure_exporting(self) -> None:
+        # start thread lazily, threads do not survive fork of gunicorn workers
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def start_trace(self, headers: Mapping[str, str]) -> Trace | None:
+        """
+        Decide whether request with given headers is sampled.
+        Return trace of sampled request, None otherwise.
+        Trace id is taken from 'traceparent' or 'X-Trace-Id' header if present.
+        A 'traceparent' with sampled flag forces sampling
+        only if respect_parent_sampled is set.
+        """
+        if self.sample_rate <= 0:
+            return None
+        trace_id = None
+        parent_span_id = None
+        is_sampled = random.random() < self.sample_rate
+        traceparent_match = TRACEPARENT_PATTERN.match(
+            headers.get(TRACEPARENT_HEADER, "")
+        )
+        if traceparent_match is not None:
+            trace_id, parent_span_id, flags = traceparent_match.groups()
+            if self.respect_parent_sampled:
+                is_sampled = is_sampled or bool(int(flags, 16) & SAMPLED_FLAG)
+        elif TRACE_ID_PATTERN.match(headers.get(TRACE_ID_HEADER, "")):
+            trace_id = headers[TRACE_ID_HEADER]
+        if not is_sampled:
+            return None
+        return Trace(self, trace_id or _new_trace_id(), parent_span_id)
+
+    def _drop(self, spans: list[dict[str, Any]]) -> None:
+        with self._lock:
+            self.dropped_span_count += len(spans)
+
+    def export(self, spans: list[dict[str, Any]]) -> None:
+        """
+        Queue spans for export without blocking.
+        Spans exported after shutdown are dropped.
+        """
+        if self._stopping.is_set():
+            self._drop(spans)
+            return
+        self._ensure_exporting()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self._drop(spans)
+
+    def shutdown(self, timeout: float = DEFAULT_SHUTDOWN_TIMEOUT_SECONDS) -> None:
+        """
+        Export queued spans and stop the export thread,
+        wait for it at most timeout seconds.
+        """
+        with self._lock:
+            if self._pid != os.getpid() or self._stopping.is_set():
+                return
+            self._stopping.set()
+        try:
+            # wake up the export thread if it waits for spans
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _collect_batch(self) -> tuple[list[dict[str, Any]], bool]:
+        # return batch and whether shutdown was requested
+        spans = self._queue.get()
+        if spans is None:
+            return [], True
+        batch = list(spans)
+        deadline = time.monotonic() + self.flush_interval_seconds
+        while len(batch) < self.batch_size:
+            remaining_seconds = deadline - time.monotonic()
+            if remaining_seconds <= 0:
+                break
+            try:
+                spans = self._queue.get(timeout=remaining_seconds)
+            except queue.Empty:
+                break
+            if spans is None:
+                return batch, True
+            batch.extend(spans)
+        return batch, self._stopping.is_set()
+
+    def _drain_queue(self) -> list[dict[str, Any]]:
+        batch = []
+        while True:
+            try:
+                spans = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if spans is not None:
+                batch.extend(spans)
+
+    def _export_batch(self, batch: list[dict[str, Any]]) -> None:
+        for start in range(0, len(batch), self.batch_size):
+            spans = batch[start : start + self.batch_size]
+            try:
+                self.sink.export(spans)
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception("Export of %s spans failed.", len(spans))
+
+    def _report_dropped_spans(self) -> None:
+        with self._lock:
+            dropped_count = self.dropped_span_count - self._reported_dropped_span_count
+            self._reported_dropped_span_count = self.dropped_span_count
+        if dropped_count:
+            self._logger.warning(
+                "Dropped %s spans because the export queue was full.", dropped_count
+            )
+
+    def _run(self) -> None:
+        is_stopping = False
+        while not is_stopping:
+            batch, is_stopping = self._collect_batch()
+            if is_stopping:
+                batch.extend(self._drain_queue())
+            self._export_batch(batch)
+            self._report_dropped_spans()
@@ -0,0 +1,173 @@
+"""
+Tools for exporting and migrating data saved by FileBasedDAO.
+
+Run e.g.:
+    python -m common.daos.export migrate data/ --shard-depth 2
+    python -m common.daos.export export data/ feedback.jsonl.gz --shard-depth 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import logging
+import pathlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator
+
+from common.daos.file_based_dao import FileBasedDAO
+
+JSONL_FORMAT = "jsonl"
+PARQUET_FORMAT = "parquet"
+
+DEFAULT_READ_WORKERS = 16
+PARQUET_BATCH_SIZE = 10_000
+
+logger = logging.getLogger(__name__)
+
+
+def read_saved_item(filepath: pathlib.Path) -> dict[str, Any] | None:
+    """
+    Read a single item saved by FileBasedDAO.
+    Return None if the file cannot be read, e.g. when it is being written
+    (FileBasedDAO creates the file before writing its content).
+    """
+    try:
+        with open(filepath, "rt", encoding="utf-8") as in_file:
+            return json.load(in_file)
+    except (OSError, ValueError) as error:
+        logger.warning("Skipping unreadable file %s: %r", filepath, error)
+        return None
+
+
+def iter_saved_items(
+    models_dao: FileBasedDAO, read_workers: int = DEFAULT_READ_WORKERS
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield all readable items saved by models_dao. Files are read in a thread
+    pool, but only a bounded number of reads is in flight at any time,
+    so memory does not grow with the number of saved files.
+    """
+    filepaths = models_dao.iter_saved_filepaths()
+    with ThreadPoolExecutor(max_workers=read_workers) as executor:
+        pending = deque()
+        for filepath in filepaths:
+            pending.append(executor.submit(read_saved_item, filepath))
+            if len(pending) >= read_workers * 4:
+                item = pending.popleft().result()
+                if item is not None:
+                    yield item
+        for future in pending:
+            item = future.result()
+            if item is not None:
+                yield item
+
+
+def _write_jsonl(items: Iterator[dict[str, Any]], output_path: str) -> int:
+    item_count = 0
+    with gzip.open(output_path, "wt", encoding="utf-8") as out_file:
+        for item in items:
+            out_file.write(json.dumps(item))
+            out_file.write("\n")
+            item_count += 1
+    return item_count
+
+
+def _write_parquet_batch(writer: Any, batch: list[dict[str, Any]], output_path: str):
+    import pyarrow  # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+
+    table = pyarrow.Table.from_pylist(batch)
+    if writer is None:
+        writer = pyarrow.parquet.ParquetWriter(
+            output_path, table.schema, compression="zstd"
+        )
+    writer.write_table(table)
+    return writer
+
+
+def _write_parquet(items: Iterator[dict[str, Any]], output_path: str) -> int:
+    # pyarrow is an optional dependency, only needed for columnar export
+    item_count = 0
+    writer = None
+    batch = []
+    try:
+        for item in items:
+            batch.append(item)
+            if len(batch) < PARQUET_BATCH_SIZE:
+                continue
+            writer = _write_parquet_batch(writer, batch, output_path)
+            item_count += len(batch)
+            batch = []
+        if batch or writer is None:
+            writer = _write_parquet_batch(writer, batch, output_path)
+            item_count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return item_count
+
+
+def export_saved_items(
+    models_dao: FileBasedDAO,
+    output_path: str,
+    output_format: str = JSONL_FORMAT,
+    read_workers: int = DEFAULT_READ_WORKERS,
+) -> int:
+    """
+    Stream all items saved by models_dao into a single compressed file,
+    either gzipped JSON lines or zstd-compressed parquet (requires pyarrow).
+    Return number of exported items.
+    """
+    writers = {JSONL_FORMAT: _write_jsonl, PARQUET_FORMAT: _write_parquet}
+    if output_format not in writers:
+        raise ValueError(f"Unsupported export format: {output_format}")
+    items = iter_saved_items(models_dao, read_workers)
+    return writers[output_format](items, output_path)
+
+
+def main(arguments: list[str] | None = None) -> None:
+    """
+    Command line entrypoint for migrating and exporting saved data.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Move saved files to a sharded layout."
+    )
+    migrate_parser.add_argument("data_directory")
+    migrate_parser.add_argument("--shard-depth", type=int, required=True)
+    migrate_parser.add_argument("--source-shard-depth", type=int, default=0)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Export all saved files into a single file."
+    )
+    export_parser.add_argument("data_directory")
+    export_parser.add_argument("output_path")
+    export_parser.add_argument("--shard-depth", type=int, default=0)
+    export_parser.add_argument(
+        "--format", choices=[JSONL_FORMAT, PARQUET_FORMAT], default=JSONL_FORMAT
+    )
+    export_parser.add_argument("--read-workers", type=int, default=DEFAULT_READ_WORKERS)
+
+    parsed = parser.parse_args(arguments)
+    models_dao = FileBasedDAO(parsed.data_directory, parsed.shard_depth)
+    if parsed.command == "migrate":
+        report = models_dao.migrate_layout(parsed.source_shard_depth)
+        print(
+            f"Moved {report.moved_count} files, "
+            f"removed {report.removed_duplicate_count} duplicates, "
+            f"skipped {report.skipped_conflict_count} conflicting files."
+        )
+    else:
+        item_count = export_saved_items(
+            models_dao, parsed.output_path, parsed.format, parsed.read_workers
+        )
+        print(f"Exported {item_count} items.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,83 @@
 from __future__ import annotations
 
+import filecmp
 import hashlib
 import json
+import logging
 import pathlib
+from typing import Iterator, NamedTuple
 
 from common.exceptions import DuplicateItemException
 
+SAVED_FILE_SUFFIX = ".json"
+SHARD_PREFIX_LENGTH = 2
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationReport(NamedTuple):
+    moved_count: int = 0
+    removed_duplicate_count: int = 0
+    skipped_conflict_count: int = 0
+
 
 class FileBasedDAO:
-    def __init__(self, data_directory: str) -> None:
+    def __init__(self, data_directory: str, shard_depth: int = 0) -> None:
+        """
+        shard_depth sets how many hash-prefix subdirectories are placed
+        between data_directory and saved files (0 keeps the flat layout).
+        E.g. with shard_depth=2, hash 'abcdef...' is saved as 'ab/cd/abcdef....json'.
+        While files saved in the flat layout are present (not migrated yet),
+        they are also checked for duplicates.
+        """
+        if shard_depth < 0 or shard_depth * SHARD_PREFIX_LENGTH > 32:
+            raise ValueError(f"Invalid shard depth: {shard_depth}")
         self.directory_path = pathlib.Path(data_directory)
+        self.shard_depth = shard_depth
+        self._has_flat_files = bool(shard_depth) and any(self.iter_saved_filepaths(0))
+        if self._has_flat_files:
+            logger.warning(
+                "Files in flat layout found in %s, migrate them to shard depth %s.",
+                self.directory_path,
+                shard_depth,
+            )
 
     @staticmethod
     def _hash_dictionary_contents(
-        input_dictionary: dict[str, str | float | bool]
+        input_dictionary: dict[str, str | float | bool],
     ) -> str:
         data_string = json.dumps(input_dictionary, sort_keys=True)
         return hashlib.md5(data_string.encode("utf=8")).hexdigest()
 
+    @staticmethod
+    def _get_shard_directory(
+        directory_path: pathlib.Path, content_hash: str, shard_depth: int
+    ) -> pathlib.Path:
+        for level in range(shard_depth):
+            start = level * SHARD_PREFIX_LENGTH
+            directory_path = (
+                directory_path / content_hash[start : start + SHARD_PREFIX_LENGTH]
+            )
+        return directory_path
+
+    def _get_filepath(self, content_hash: str) -> pathlib.Path:
+        shard_directory = self._get_shard_directory(
+            self.directory_path, content_hash, self.shard_depth
+        )
+        return shard_directory / f"{content_hash}{SAVED_FILE_SUFFIX}"
+
     def save_scoring_result(
         self, input_dictionary: dict[str, str | float | bool]
     ) -> pathlib.Path:
-        filepath = (
-            self.directory_path
-            / f"{self._hash_dictionary_contents(input_dictionary)}.json"
-        )
+        content_hash = self._hash_dictionary_contents(input_dictionary)
+        if (
+            self._has_flat_files
+            and (self.directory_path / f"{content_hash}{SAVED_FILE_SUFFIX}").exists()
+        ):
+            raise DuplicateItemException
+        filepath = self._get_filepath(content_hash)
+        if self.shard_depth:
+            filepath.parent.mkdir(parents=True, exist_ok=True)
         try:
             filepath.touch(exist_ok=False)  # avoid race condition
             # filepath.touch -> if the file does not exist, 'claim' the name
@@ -33,3 +86,57 @@ class FileBasedDAO:
         with open(filepath, "wt", encoding="utf-8") as out_file:
             json.dump(input_dictionary, out_file)
         return filepath
+
+    def iter_saved_filepaths(
+        self, shard_depth: int | None = None
+    ) -> Iterator[pathlib.Path]:
+        """
+        Yield paths of all saved files stored in layout with given shard_depth
+        (the DAO's own layout by default).
+        """
+        shard_depth = self.shard_depth if shard_depth is None else shard_depth
+        pattern = "/".join(["*"] * shard_depth + [f"*{SAVED_FILE_SUFFIX}"])
+        yield from self.directory_path.glob(pattern)
+
+    def _prune_empty_shard_directories(self, shard_depth: int) -> None:
+        # deepest directories first, so that emptied parents are pruned too
+        for depth in range(shard_depth, 0, -1):
+            pattern = "/".join(["[0-9a-f]" * SHARD_PREFIX_LENGTH] * depth)
+            for directory in self.directory_path.glob(pattern):
+                if directory.is_dir() and not any(directory.iterdir()):
+                    directory.rmdir()
+
+    def migrate_layout(self, source_shard_depth: int = 0) -> MigrationReport:
+        """
+        Move files saved in layout with source_shard_depth to the DAO's layout
+        and remove emptied shard directories of the source layout.
+        If a file already exists at the target location, an identical source
+        file is removed, a different one is left in place and logged.
+        """
+        if source_shard_depth == self.shard_depth:
+            return MigrationReport()
+        moved_count = 0
+        removed_duplicate_count = 0
+        skipped_conflict_count = 0
+        # materialize the listing so that moved files are not listed again
+        for source_path in list(self.iter_saved_filepaths(source_shard_depth)):
+            target_path = self._get_filepath(source_path.stem)
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            if not target_path.exists():
+                source_path.rename(target_path)
+                moved_count += 1
+            elif filecmp.cmp(source_path, target_path, shallow=False):
+                source_path.unlink()
+                removed_duplicate_count += 1
+            else:
+                logger.warning(
+                    "Not migrating %s, different file exists at %s.",
+                    source_path,
+                    target_path,
+                )
+                skipped_conflict_count += 1
+        if source_shard_depth > self.shard_depth:
+            self._prune_empty_shard_directories(source_shard_depth)
+        return MigrationReport(
+            moved_count, removed_duplicate_count, skipped_conflict_count
+        )
@@ -15,3 +15,23 @@ class DuplicateItemException(ModelServingAssignmentException):
     Raised when attempting to item whose contents have already
     been saved.
     """
+
+
+class InferenceQueueFullException(ModelServingAssignmentException):
+    """
+    Raised when inference request cannot be queued because
+    the model's queue is full.
+    """
+
+
+class InferenceTimeoutException(ModelServingAssignmentException):
+    """
+    Raised when inference does not finish in time.
+    """
+
+
+class InferenceUnavailableException(ModelServingAssignmentException):
+    """
+    Raised when inference cannot be done, e.g. the inference pool
+    is not reachable or fails.
+    """
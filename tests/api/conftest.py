@@ -1,7 +1,9 @@
+import tempfile
 from unittest.mock import MagicMock
 
 import pytest
 
+from api.flask_app import create_app
 from api.model_serving_api import API
 from common.daos.file_based_dao import FileBasedDAO
 from common.exceptions import DuplicateItemException
@@ -30,3 +32,11 @@ def api_without_duplicates():
 @pytest.fixture(scope="function")
 def api_with_duplicates():
     return API(DummyDAOSaveDuplicateError(), MagicMock())
+
+
+@pytest.fixture(scope="session")
+def flask_client():
+    # metrics are registered globally, so the app can be created only once
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = create_app({"DATA_DIRECTORY": tmp_dir, "METRICS_CACHE_SECONDS": "0"})
+        yield app.test_client()
@@ -1,8 +1,52 @@
 import datetime
+import gzip
 import json
+import os
+import pathlib
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 
-from api.model_serving_api import SENTIMENT_KEY, SentimentValue
+from prometheus_client import CollectorRegistry, Counter, generate_latest
+
+from api.flask_app import WARM_UP_ATTEMPTS, warm_up_api
+from api.inference_server import InferenceBatcher, InferenceClient, InferencePool
+from api.language_routing import (
+    DEFAULT_LANGUAGE_CODE,
+    LanguageModelExecutor,
+    LanguageRouter,
+    normalize_language_code,
+)
+from api.metrics import (
+    MULTIPROCESS_DIRECTORY_KEY,
+    MetricsExporter,
+    clear_multiprocess_directory,
+    create_metrics_registry,
+    mark_process_dead,
+)
+from api.model_serving_api import (
+    ERRORS_KEY,
+    SENTIMENT_KEY,
+    SentimentValue,
+    aggregate_sentiments,
+    split_text_into_chunks,
+)
+from api.startup import TOTAL_STEP, StartupProfiler
+from api.tracing import (
+    NO_OP_SPAN,
+    FileSpanSink,
+    OTLPHTTPSpanSink,
+    Tracer,
+    trace_span,
+)
+from common.daos.export import export_saved_items
+from common.daos.file_based_dao import MigrationReport
+from common.exceptions import (
+    InferenceQueueFullException,
+    InferenceTimeoutException,
+)
 
 from .conftest import *
 
@@ -53,6 +97,94 @@ class TestFileBasedDAO:
             with pytest.raises(DuplicateItemException):
                 dao.save_scoring_result(input_dict)
 
+    def test_save_scoring_result_sharded(self):
+        input_dict = {"ggg": 111}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dao = FileBasedDAO(tmp_dir, shard_depth=2)
+            filepath = dao.save_scoring_result(input_dict)
+
+            content_hash = dao._hash_dictionary_contents(input_dict)
+            expected_path = (
+                pathlib.Path(tmp_dir)
+                / content_hash[:2]
+                / content_hash[2:4]
+                / f"{content_hash}.json"
+            )
+            assert filepath == expected_path
+            with pytest.raises(DuplicateItemException):
+                dao.save_scoring_result(input_dict)
+
+    def test_save_scoring_result_sharded_before_migration(self):
+        input_dict = {"ggg": 111}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            FileBasedDAO(tmp_dir).save_scoring_result(input_dict)
+            sharded_dao = FileBasedDAO(tmp_dir, shard_depth=2)
+
+            with pytest.raises(DuplicateItemException):
+                sharded_dao.save_scoring_result(input_dict)
+
+    def test_migrate_layout(self):
+        input_dicts = [{"ggg": 111}, {"ggg": 222}]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            flat_dao = FileBasedDAO(tmp_dir)
+            for input_dict in input_dicts:
+                flat_dao.save_scoring_result(input_dict)
+
+            sharded_dao = FileBasedDAO(tmp_dir, shard_depth=2)
+            report = sharded_dao.migrate_layout(source_shard_depth=0)
+            assert report == MigrationReport(moved_count=2)
+            assert list(flat_dao.iter_saved_filepaths()) == []
+            assert len(list(sharded_dao.iter_saved_filepaths())) == 2
+            with pytest.raises(DuplicateItemException):
+                sharded_dao.save_scoring_result(input_dicts[0])
+
+    def test_migrate_layout_duplicates_and_pruning(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sharded_dao = FileBasedDAO(tmp_dir, shard_depth=2)
+            duplicate_path = sharded_dao.save_scoring_result({"ggg": 111})
+            conflict_path = sharded_dao.save_scoring_result({"ggg": 222})
+            sharded_dao.save_scoring_result({"ggg": 333})
+
+            flat_dao = FileBasedDAO(tmp_dir)
+            flat_dao.save_scoring_result({"ggg": 111})
+            flat_dao.save_scoring_result({"ggg": 222})
+            # same name, different content
+            conflict_path.write_text("{}")
+
+            report = flat_dao.migrate_layout(source_shard_depth=2)
+
+            assert report == MigrationReport(1, 1, 1)
+            assert not duplicate_path.parent.exists()
+            assert conflict_path.exists()
+            assert len(list(flat_dao.iter_saved_filepaths())) == 3
+
+    def test_export_saved_items_skips_unreadable(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dao = FileBasedDAO(tmp_dir)
+            dao.save_scoring_result({"ggg": 111})
+            # file claimed by save_scoring_result but not written yet
+            (pathlib.Path(tmp_dir) / "0123456789abcdef0123456789abcdef.json").touch()
+
+            output_path = pathlib.Path(tmp_dir) / "export.jsonl.gz"
+            assert export_saved_items(dao, str(output_path)) == 1
+
+    def test_export_saved_items_jsonl(self):
+        input_dicts = [{"ggg": index} for index in range(10)]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dao = FileBasedDAO(tmp_dir, shard_depth=1)
+            for input_dict in input_dicts:
+                dao.save_scoring_result(input_dict)
+
+            output_path = pathlib.Path(tmp_dir) / "export.jsonl.gz"
+            assert export_saved_items(dao, str(output_path), read_workers=2) == 10
+            with gzip.open(output_path, "rt") as in_file:
+                exported_dicts = [json.loads(line) for line in in_file]
+            assert sorted(exported_dicts, key=lambda item: item["ggg"]) == input_dicts
+
 
 class TestModelServingAPI:
     @pytest.mark.parametrize(
@@ -149,3 +281,640 @@ class TestModelServingAPI:
     def test_save_sentiment_valid(self, api_without_duplicates, input_dict):
         _, status_code = api_without_duplicates.save_sentiment(input_dict)
         assert status_code == 201
+
+    def test_get_sentiment_text_too_long(self):
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock(), max_text_length=5)
+        _, status_code = api.get_sentiment({"text": "abcdef", "languageCode": "en"})
+        assert status_code == 413
+
+    def test_save_sentiment_text_too_long(self):
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock(), max_text_length=5)
+        _, status_code = api.save_sentiment(
+            {
+                "text": "abcdef",
+                "languageCode": "en",
+                "sentiment": "positive",
+                "isGoodTranslation": True,
+            }
+        )
+        assert status_code == 413
+
+    def test_get_sentiment_chunked(self):
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock(), inference_chunk_length=10)
+        api._label_sentiment_batch = MagicMock(
+            return_value=[SentimentValue.POSITIVE] * 3
+        )
+        response, status_code = api.get_sentiment(
+            {"text": " ".join(["word"] * 6), "languageCode": "en"}
+        )
+        assert status_code == 200
+        assert response[SENTIMENT_KEY] == SentimentValue.POSITIVE
+        api._label_sentiment_batch.assert_called_once_with(
+            ["word word", "word word", "word word"], "en"
+        )
+
+
+@pytest.mark.parametrize(
+    "text,chunk_length,expected_chunks",
+    [
+        ("", 5, [""]),
+        ("abc", 5, ["abc"]),
+        ("abc def ghi", 7, ["abc def", "ghi"]),
+        ("abcdefghij", 4, ["abcd", "efgh", "ij"]),
+        ("ab   cdefgh", 4, ["ab", "cdef", "gh"]),
+        ("abc\ndef\tghi", 7, ["abc\ndef", "ghi"]),
+        ("  abc def", 4, ["abc", "def"]),
+        ("abcd efgh", 4, ["abcd", "efgh"]),
+    ],
+)
+def test_split_text_into_chunks(text, chunk_length, expected_chunks):
+    assert split_text_into_chunks(text, chunk_length) == expected_chunks
+
+
+@pytest.mark.parametrize(
+    "sentiments,weights,expected_sentiment",
+    [
+        ([SentimentValue.POSITIVE], [1], SentimentValue.POSITIVE),
+        (
+            [SentimentValue.POSITIVE, SentimentValue.NEGATIVE],
+            [1, 1],
+            SentimentValue.NEUTRAL,
+        ),
+        (
+            [SentimentValue.NEGATIVE, SentimentValue.NEUTRAL],
+            [10, 1],
+            SentimentValue.NEGATIVE,
+        ),
+        ([SentimentValue.POSITIVE], [0], SentimentValue.NEUTRAL),
+    ],
+)
+def test_aggregate_sentiments(sentiments, weights, expected_sentiment):
+    assert aggregate_sentiments(sentiments, weights) == expected_sentiment
+
+
+@pytest.mark.parametrize(
+    "language_code,expected_code",
+    [
+        ("en", "en"),
+        ("EN", "en"),
+        ("en-US", "en"),
+        (" en_gb ", "en"),
+        ("CZ", "cz"),
+        ("", DEFAULT_LANGUAGE_CODE),
+    ],
+)
+def test_normalize_language_code(language_code, expected_code):
+    assert normalize_language_code(language_code) == expected_code
+
+
+class TestLanguageRouter:
+    def test_label_loads_model_once_per_language(self):
+        model_loader = MagicMock(return_value=lambda texts: ["label"] * len(texts))
+        router = LanguageRouter(model_loader)
+
+        assert router.label(["a", "b"], "EN") == ["label", "label"]
+        assert router.label(["a"], "en-US") == ["label"]
+        assert router.label(["a"], "de") == ["label"]
+
+        assert [call.args for call in model_loader.call_args_list] == [("en",), ("de",)]
+        metrics = router.get_metrics()
+        assert set(metrics) == {"en", "de"}
+        assert metrics["en"]["completed"] == 2
+        router.shutdown()
+
+    def test_label_unsupported_language_uses_default_model(self):
+        model_loader = MagicMock(return_value=lambda texts: texts)
+        router = LanguageRouter(model_loader, supported_languages=["EN"])
+
+        router.label(["a"], "en-US")
+        router.label(["a"], "de")
+
+        assert set(router.get_metrics()) == {"en", DEFAULT_LANGUAGE_CODE}
+        router.shutdown()
+
+    def test_slow_model_load_does_not_block_other_languages(self):
+        load_released = threading.Event()
+
+        def model_loader(language_code):
+            if language_code == "de":
+                load_released.wait()
+            return lambda texts: texts
+
+        router = LanguageRouter(model_loader)
+        slow_future = router.get_executor_future("de")
+
+        assert router.label(["a"], "en") == ["a"]
+        assert not slow_future.done()
+        load_released.set()
+        assert router.label(["b"], "de") == ["b"]
+        router.shutdown()
+
+    def test_failed_model_load_is_retried(self):
+        model_loader = MagicMock(side_effect=[RuntimeError(), lambda texts: texts])
+        router = LanguageRouter(model_loader)
+
+        with pytest.raises(RuntimeError):
+            router.label(["a"], "en")
+        assert router.label(["a"], "en") == ["a"]
+        router.shutdown()
+
+    def test_label_full_queue(self):
+        model_released = threading.Event()
+        model_started = threading.Event()
+
+        def blocking_model(texts):
+            model_started.set()
+            model_released.wait()
+            return texts
+
+        executor = LanguageModelExecutor("en", blocking_model, 1, 0)
+        blocked_thread = threading.Thread(target=executor.label, args=(["a"],))
+        blocked_thread.start()
+        model_started.wait()
+
+        with pytest.raises(InferenceQueueFullException):
+            executor.label(["b"])
+        assert executor.get_metrics()["rejected"] == 1
+
+        model_released.set()
+        blocked_thread.join()
+        assert executor.label(["c"]) == ["c"]
+        executor.shutdown()
+
+    def test_label_timeout_cancels_queued_batch(self):
+        model_released = threading.Event()
+        labelled_texts = []
+
+        def blocking_model(texts):
+            model_released.wait()
+            labelled_texts.extend(texts)
+            return texts
+
+        executor = LanguageModelExecutor("en", blocking_model, 1, 1)
+        executor.submit(["a"])
+
+        with pytest.raises(InferenceTimeoutException):
+            executor.label(["b"], timeout=0.01)
+        # slot of the cancelled batch is free again
+        queued_future = executor.submit(["c"])
+        model_released.set()
+
+        assert queued_future.result(timeout=5) == ["c"]
+        assert labelled_texts == ["a", "c"]
+        assert executor.get_metrics()["cancelled"] == 1
+        executor.shutdown()
+
+    def test_get_sentiment_routed(self):
+        router = LanguageRouter(API.load_model)
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock(), language_router=router)
+
+        response, status_code = api.get_sentiment({"text": "fff", "languageCode": "EN"})
+
+        assert status_code == 200
+        assert isinstance(response[SENTIMENT_KEY], SentimentValue)
+        assert set(api.get_language_metrics()) == {"en"}
+        router.shutdown()
+
+    def test_get_sentiment_model_overloaded(self):
+        router = MagicMock()
+        router.label.side_effect = InferenceQueueFullException("en")
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock(), language_router=router)
+
+        _, status_code = api.get_sentiment({"text": "fff", "languageCode": "en"})
+
+        assert status_code == 503
+
+
+class TestInferencePool:
+    def test_batcher_batches_requests_by_language(self):
+        model_loader = MagicMock(
+            side_effect=lambda language_code: lambda texts: [
+                f"{language_code}:{text}" for text in texts
+            ]
+        )
+        router = LanguageRouter(model_loader)
+        batcher = InferenceBatcher(
+            router, max_batch_size=10, max_batch_delay_seconds=0.5
+        )
+
+        futures = [
+            batcher.submit(["a", "b"], "en"),
+            batcher.submit(["c"], "EN"),
+            batcher.submit(["d"], "de"),
+        ]
+
+        assert [future.result(timeout=5) for future in futures] == [
+            ["en:a", "en:b"],
+            ["en:c"],
+            ["de:d"],
+        ]
+        assert router.get_metrics()["en"]["completed"] == 1
+        router.shutdown()
+
+    def test_batcher_not_blocked_by_model_load(self):
+        load_released = threading.Event()
+
+        def model_loader(language_code):
+            if language_code == "de":
+                load_released.wait()
+            return lambda texts: texts
+
+        router = LanguageRouter(model_loader)
+        batcher = InferenceBatcher(router, max_batch_delay_seconds=0)
+
+        slow_future = batcher.submit(["a"], "de")
+        assert batcher.submit(["b"], "en").result(timeout=5) == ["b"]
+        assert not slow_future.done()
+        load_released.set()
+        assert slow_future.result(timeout=5) == ["a"]
+        router.shutdown()
+
+    def test_batcher_skips_cancelled_requests(self):
+        model_released = threading.Event()
+        labelled_texts = []
+
+        def blocking_model(texts):
+            model_released.wait()
+            labelled_texts.extend(texts)
+            return texts
+
+        router = LanguageRouter(lambda language_code: blocking_model)
+        executor = router.get_executor("en")
+        batcher = InferenceBatcher(router, max_batch_delay_seconds=0)
+
+        running_future = batcher.submit(["a"], "en")
+        cancelled_future = batcher.submit(["b"], "en")
+        # wait until both batches are passed to the model
+        for _ in range(500):
+            metrics = executor.get_metrics()
+            if metrics["running"] + metrics["queue_size"] == 2:
+                break
+            time.sleep(0.01)
+        assert cancelled_future.cancel()
+        model_released.set()
+
+        assert running_future.result(timeout=5) == ["a"]
+        assert executor.get_metrics()["cancelled"] == 1
+        assert labelled_texts == ["a"]
+        router.shutdown()
+
+    def test_client_labels_by_pool(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = InferencePool(
+                str(pathlib.Path(tmp_dir) / "inference.sock"),
+                API.load_model,
+                processes=2,
+            )
+            pool.start()
+            try:
+                client = InferenceClient(pool.socket_path, timeout=10)
+                api = API(
+                    DummyDAOSaveNoDuplicate(), MagicMock(), inference_client=client
+                )
+
+                response, status_code = api.get_sentiment(
+                    {"text": "fff", "languageCode": "en-US"}
+                )
+
+                assert status_code == 200
+                assert isinstance(response[SENTIMENT_KEY], SentimentValue)
+                assert set(api.get_language_metrics()) == {"en"}
+            finally:
+                pool.stop()
+
+    def test_get_sentiment_pool_unavailable(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            client = InferenceClient(str(pathlib.Path(tmp_dir) / "missing.sock"))
+            api = API(DummyDAOSaveNoDuplicate(), MagicMock(), inference_client=client)
+
+            response, status_code = api.get_sentiment(
+                {"text": "fff", "languageCode": "en"}
+            )
+
+            assert status_code == 503
+            assert response == {ERRORS_KEY: ["model unavailable"]}
+
+    def test_pool_restarts_dead_processes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = InferencePool(
+                str(pathlib.Path(tmp_dir) / "inference.sock"), API.load_model
+            )
+            pool.start()
+            try:
+                pool._processes[0].kill()
+                client = InferenceClient(pool.socket_path, timeout=10)
+
+                assert len(client.label(["fff"], "en")) == 1
+                assert pool._processes[0].is_alive()
+            finally:
+                pool.stop()
+
+    def test_supervisor_serves_until_terminated(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = pathlib.Path(tmp_dir) / "inference.sock"
+            supervisor = subprocess.Popen(
+                [sys.executable, "-m", "api.inference_server"],
+                env={**os.environ, "INFERENCE_SOCKET_PATH": str(socket_path)},
+            )
+            try:
+                client = InferenceClient(str(socket_path), timeout=10)
+                for _ in range(100):
+                    if socket_path.exists():
+                        break
+                    time.sleep(0.1)
+
+                assert len(client.label(["fff"], "en")) == 1
+            finally:
+                supervisor.terminate()
+                assert supervisor.wait(timeout=10) == 0
+            assert not socket_path.exists()
+
+
+class TestMetricsExporter:
+    def test_get_exposition_cached(self):
+        registry = CollectorRegistry()
+        counter = Counter("calls", "Calls.", registry=registry)
+        exporter = MetricsExporter(registry, cache_seconds=60)
+
+        exposition, _ = exporter.get_exposition()
+        counter.inc()
+        cached_exposition, _ = exporter.get_exposition()
+
+        assert b"calls_total 0.0" in exposition
+        assert cached_exposition == exposition
+
+    def test_get_exposition_refreshed(self):
+        registry = CollectorRegistry()
+        counter = Counter("calls", "Calls.", registry=registry)
+        exporter = MetricsExporter(registry, cache_seconds=0)
+
+        exporter.get_exposition()
+        counter.inc()
+        exposition, _ = exporter.get_exposition()
+
+        assert b"calls_total 1.0" in exposition
+
+    def test_get_exposition_gzip(self):
+        registry = CollectorRegistry()
+        Counter("calls", "Calls.", registry=registry)
+        exporter = MetricsExporter(registry)
+
+        exposition, headers = exporter.get_exposition()
+        gzipped_exposition, gzip_headers = exporter.get_exposition(use_gzip=True)
+
+        assert "Content-Encoding" not in headers
+        assert gzip_headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(gzipped_exposition) == exposition
+
+
+class TestStartup:
+    def test_startup_profiler_report(self):
+        profiler = StartupProfiler()
+        with profiler.step("first"):
+            pass
+        with pytest.raises(ValueError):
+            with profiler.step("failing"):
+                raise ValueError()
+
+        report = profiler.report()
+
+        assert set(report) == {"first", "failing", TOTAL_STEP}
+        assert report[TOTAL_STEP] >= report["first"] + report["failing"]
+
+    def test_api_ready_after_warm_up(self):
+        router = LanguageRouter(API.load_model)
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock(), language_router=router)
+
+        assert not api.is_ready
+        api.warm_up(["en", "de"])
+        api.mark_ready()
+
+        assert api.is_ready
+        assert set(router.get_metrics()) == {"en", "de"}
+        router.shutdown()
+
+    def test_warm_up_api_failed(self, monkeypatch):
+        monkeypatch.setattr("api.flask_app.WARM_UP_RETRY_DELAY_SECONDS", 0)
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock())
+        api.warm_up = MagicMock(side_effect=RuntimeError())
+
+        warm_up_api(api, ["en"], StartupProfiler())
+
+        assert api.warm_up.call_count == WARM_UP_ATTEMPTS
+        assert not api.is_ready
+        assert api.has_failed
+
+    def test_warm_up_api_retried(self, monkeypatch):
+        monkeypatch.setattr("api.flask_app.WARM_UP_RETRY_DELAY_SECONDS", 0)
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock())
+        api.warm_up = MagicMock(side_effect=[RuntimeError(), None])
+
+        warm_up_api(api, ["en"], StartupProfiler())
+
+        assert api.is_ready
+        assert not api.has_failed
+
+    def test_warm_up_api_timed_out(self, monkeypatch):
+        monkeypatch.setattr("api.flask_app.WARM_UP_RETRY_DELAY_SECONDS", 60)
+        api = API(DummyDAOSaveNoDuplicate(), MagicMock())
+        api.warm_up = MagicMock(side_effect=RuntimeError())
+
+        warm_up_api(api, ["en"], StartupProfiler(), timeout=1)
+
+        assert api.warm_up.call_count == 1
+        assert api.has_failed
+
+    def test_app_ready_when_created(self, flask_client):
+        assert flask_client.get("/ready").status_code == 200
+
+
+class DummySpanSink:
+    def __init__(self):
+        self.spans = []
+        self.exported = threading.Event()
+
+    def export(self, spans):
+        self.spans.extend(spans)
+        self.exported.set()
+
+
+class BlockingSpanSink(DummySpanSink):
+    def __init__(self):
+        super().__init__()
+        self.release_export = threading.Event()
+
+    def export(self, spans):
+        super().export(spans)
+        self.release_export.wait(timeout=5)
+
+
+class TestTracing:
+    TRACEPARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+    def test_start_trace_sampling_off(self):
+        tracer = Tracer(DummySpanSink(), sample_rate=0)
+        assert tracer.start_trace({"traceparent": self.TRACEPARENT}) is None
+        assert trace_span(None, "inference") is NO_OP_SPAN
+
+    @pytest.mark.parametrize(
+        "headers,expected_trace_id,expected_parent_span_id",
+        [
+            (
+                {"traceparent": TRACEPARENT},
+                "0af7651916cd43dd8448eb211c80319c",
+                "b7ad6b7169203331",
+            ),
+            (
+                {"X-Trace-Id": "0af7651916cd43dd8448eb211c80319c"},
+                "0af7651916cd43dd8448eb211c80319c",
+                None,
+            ),
+        ],
+    )
+    def test_start_trace_propagates_trace_id(
+        self, headers, expected_trace_id, expected_parent_span_id
+    ):
+        tracer = Tracer(DummySpanSink(), sample_rate=1)
+        trace = tracer.start_trace(headers)
+        assert trace.trace_id == expected_trace_id
+        assert trace.parent_span_id == expected_parent_span_id
+
+    def test_start_trace_sampled_flag_ignored_by_default(self):
+        tracer = Tracer(DummySpanSink(), sample_rate=1e-12)
+        assert tracer.start_trace({"traceparent": self.TRACEPARENT}) is None
+
+    def test_start_trace_sampled_flag_forces_sampling(self):
+        tracer = Tracer(DummySpanSink(), sample_rate=1e-12, respect_parent_sampled=True)
+        assert tracer.start_trace({"traceparent": self.TRACEPARENT}) is not None
+        assert tracer.start_trace({}) is None
+
+    def test_shutdown_exports_queued_spans(self):
+        sink = DummySpanSink()
+        tracer = Tracer(sink, sample_rate=1, flush_interval_seconds=60)
+        tracer.export([{"name": "first"}])
+        tracer.export([{"name": "second"}])
+
+        tracer.shutdown()
+        tracer.export([{"name": "late"}])
+
+        assert [span["name"] for span in sink.spans] == ["first", "second"]
+        assert tracer.dropped_span_count == 1
+
+    def test_dropped_spans_logged(self, caplog):
+        sink = BlockingSpanSink()
+        tracer = Tracer(sink, sample_rate=1, flush_interval_seconds=0, max_queue_size=1)
+        tracer.export([{"name": "exporting"}])
+        assert sink.exported.wait(timeout=5)
+        tracer.export([{"name": "queued"}])
+        tracer.export([{"name": "dropped"}])
+
+        sink.release_export.set()
+        tracer.shutdown()
+
+        assert [span["name"] for span in sink.spans] == ["exporting", "queued"]
+        assert "Dropped 1 spans" in caplog.text
+
+    def test_get_sentiment_spans_exported(self):
+        sink = DummySpanSink()
+        tracer = Tracer(sink, sample_rate=1, flush_interval_seconds=0)
+        trace = tracer.start_trace({})
+
+        _, status_code = API(DummyDAOSaveNoDuplicate(), MagicMock()).get_sentiment(
+            {"text": "fff", "languageCode": "en"}, trace
+        )
+        trace.finish("request")
+
+        assert status_code == 200
+        assert sink.exported.wait(timeout=5)
+        assert [span["name"] for span in sink.spans] == [
+            "validation",
+            "inference",
+            "request",
+        ]
+        assert {span["parent_span_id"] for span in sink.spans[:2]} == {
+            trace.root_span_id
+        }
+
+    def test_file_span_sink_appends_batches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(pathlib.Path(tmp_dir) / "spans.jsonl")
+            sink = FileSpanSink(path)
+
+            sink.export([{"name": "first"}, {"name": "second"}])
+            sink.export([{"name": "third"}])
+
+            with open(path, "rt") as in_file:
+                names = [json.loads(line)["name"] for line in in_file]
+            assert names == ["first", "second", "third"]
+
+    def test_to_otlp(self):
+        span = {
+            "trace_id": "0af7651916cd43dd8448eb211c80319c",
+            "span_id": "b7ad6b7169203331",
+            "parent_span_id": None,
+            "name": "request",
+            "start_time_unix_nano": 1,
+            "end_time_unix_nano": 2,
+            "attributes": {"http.status_code": 200},
+        }
+        payload = OTLPHTTPSpanSink.to_otlp([span])
+        otlp_span = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        assert otlp_span["traceId"] == span["trace_id"]
+        assert otlp_span["parentSpanId"] == ""
+        assert otlp_span["endTimeUnixNano"] == "2"
+        assert otlp_span["attributes"] == [
+            {"key": "http.status_code", "value": {"stringValue": "200"}}
+        ]
+
+
+WORKER_METRICS_SCRIPT = """
+import os
+from prometheus_client import Counter, Gauge
+Counter("calls", "Calls.").inc(2)
+Gauge("up", "Up.", multiprocess_mode="livemax").set(1)
+print(os.getpid())
+"""
+
+
+class TestMultiprocessMetrics:
+    @staticmethod
+    def _run_worker(multiprocess_directory):
+        completed = subprocess.run(
+            [sys.executable, "-c", WORKER_METRICS_SCRIPT],
+            env={**os.environ, MULTIPROCESS_DIRECTORY_KEY: multiprocess_directory},
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        return int(completed.stdout)
+
+    def test_metrics_aggregated_across_processes(self, monkeypatch):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            monkeypatch.setenv(MULTIPROCESS_DIRECTORY_KEY, tmp_dir)
+            first_pid = self._run_worker(tmp_dir)
+            second_pid = self._run_worker(tmp_dir)
+
+            registry = create_metrics_registry()
+            assert b"calls_total 4.0" in generate_latest(registry)
+            assert b"up 1.0" in generate_latest(registry)
+
+            mark_process_dead(first_pid)
+            mark_process_dead(second_pid)
+            exposition = generate_latest(registry)
+            assert b"calls_total 4.0" in exposition
+            assert b"up 1.0" not in exposition
+
+            clear_multiprocess_directory()
+            assert os.listdir(tmp_dir) == []
+
+    def test_metrics_route_content_encoding(self, flask_client):
+        identity_response = flask_client.get("/metrics")
+        gzip_response = flask_client.get(
+            "/metrics", headers={"Accept-Encoding": "gzip, deflate"}
+        )
+
+        assert identity_response.status_code == 200
+        assert "Content-Encoding" not in identity_response.headers
+        assert b"endpoint_calls" in identity_response.data
+        assert gzip_response.headers["Content-Encoding"] == "gzip"
+        assert b"endpoint_calls" in gzip.decompress(gzip_response.data)
@@ -1,5 +1,40 @@
+import os
+import subprocess
+import sys
+
 timeout = 120
 workers = 4
 threads = 1
 bind = "0.0.0.0:5000"
 loglevel = "info"
+
+INFERENCE_SUPERVISOR_STOP_TIMEOUT = 30
+
+
+def on_starting(server):
+    from api.metrics import clear_multiprocess_directory
+
+    clear_multiprocess_directory()
+    # start inference process pool shared by all workers, if configured;
+    # it runs in a separate executable, so that workers do not inherit
+    # its processes and the arbiter does not reap them
+    if os.environ.get("INFERENCE_SOCKET_PATH"):
+        server.inference_supervisor = subprocess.Popen(
+            [sys.executable, "-m", "api.inference_server"]
+        )
+
+
+def on_exit(server):
+    inference_supervisor = getattr(server, "inference_supervisor", None)
+    if inference_supervisor is not None:
+        inference_supervisor.terminate()
+        try:
+            inference_supervisor.wait(timeout=INFERENCE_SUPERVISOR_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            inference_supervisor.kill()
+
+
+def child_exit(server, worker):
+    from api.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)